@@ -4,12 +4,19 @@ l'agent doit retourner l'input exact dans <INPUT>...</INPUT> qui reproduit la so
 """
 from __future__ import annotations
 
+import contextlib
+import io
 import json
 import re
-import random
-import subprocess
+import sys
+import traceback
+from types import CodeType
 from typing import Any, Dict, Optional, Tuple
 
+from .env_cache import LRUEnvCache
+from .shuffled_ring import ShuffledRing
+from .worker_pool import get_pool
+
 
 PROMPT_TEMPLATE = (
     "You are a programming expert. Given a Python program and its expected output, you need to determine the exact input that would produce this output.\n\n"
@@ -26,30 +33,82 @@ PROMPT_TEMPLATE = (
     "Please analyze the program and provide the required input:"
 )
 
-
-def _execute_python(program: str, stdin: str, timeout_s: float = 2.0) -> Tuple[str, str]:
+# PROMPT_TEMPLATE pre-split around its two fields, joined in generate().
+_PROMPT_HEAD, _PROMPT_REST = PROMPT_TEMPLATE.split("{program}")
+_PROMPT_MID, _PROMPT_TAIL = _PROMPT_REST.split("{output}")
+
+_THINK_RE = re.compile(r"<think>.*?</think>", re.DOTALL)
+_THINKING_RE = re.compile(r"<thinking>.*?</thinking>", re.DOTALL)
+_INPUT_RE = re.compile(r"<INPUT>(.*?)</INPUT>", re.IGNORECASE | re.DOTALL)
+# Whitespace ending a line (or the text).
+_TRAIL_WS_RE = re.compile(r"[ \t\r\f\v]+(?=\n|\Z)")
+
+# (program, example stdin) pairs the challenges are drawn from.
+_PROGRAM_POOL: Tuple[Tuple[str, str], ...] = (
+    (
+        "n = int(input())\nprint(n*n)",
+        "7\n",
+    ),
+    (
+        "a,b = map(int, input().split())\nprint(a+b)\nprint(a*b)",
+        "3 4\n",
+    ),
+    (
+        "import sys\nlines = sys.stdin.read().strip().split()\nprint(sum(map(int, lines)))",
+        "5 6 7\n",
+    ),
+    (
+        "s = input().strip()\nprint(s[::-1])",
+        "abcde\n",
+    ),
+)
+_FALLBACK_PROGRAM: Tuple[str, str] = (
+    "x = int(input())\nprint(x+1)",
+    "9\n",
+)
+# Hand-written programs that terminate on any stdin: safe to run in-process.
+_TRUSTED_PROGRAMS = frozenset(prog for prog, _ in _PROGRAM_POOL + (_FALLBACK_PROGRAM,))
+# Their cost grows with their stdin (at worst quadratically, int() parsing and
+# squaring a number on Pythons without the 3.11 digit limit), so bounding its
+# size bounds how long they can hold the event loop. Larger inputs run in the
+# worker pool, under its timeout.
+_MAX_TRUSTED_STDIN = 1 << 12
+_compiled_cache: Dict[str, CodeType] = {}
+
+
+def _execute_trusted(program: str, stdin: str) -> Tuple[str, str]:
+    code = _compiled_cache.get(program)
+    if code is None:
+        code = _compiled_cache[program] = compile(program, "<abd>", "exec")
+    out, err = io.StringIO(), io.StringIO()
+    real_stdin = sys.stdin
+    sys.stdin = io.StringIO(stdin)
     try:
-        res = subprocess.run(
-            ["python3", "-c", program],
-            input=stdin,
-            text=True,
-            capture_output=True,
-            timeout=timeout_s,
-        )
-        return res.stdout, res.stderr
-    except subprocess.TimeoutExpired:
-        return "", "TIMEOUT"
+        with contextlib.redirect_stdout(out), contextlib.redirect_stderr(err):
+            exec(code, {"__name__": "__main__"})
+    except Exception as e:
+        err.write("".join(traceback.format_exception(type(e), e, e.__traceback__.tb_next)))
+    finally:
+        sys.stdin = real_stdin
+    return out.getvalue(), err.getvalue()
+
+
+async def _execute_python(program: str, stdin: str, timeout_s: float = 2.0) -> Tuple[str, str]:
+    if program in _TRUSTED_PROGRAMS and len(stdin) <= _MAX_TRUSTED_STDIN:
+        return _execute_trusted(program, stdin)
+    out, err = await get_pool().submit(program, stdin, timeout_s)
+    return out.decode(errors="ignore"), err.decode(errors="ignore")
 
 
 def _strip_think_blocks(text: str) -> str:
-    text = re.sub(r"<think>.*?</think>", "", text, flags=re.DOTALL)
-    text = re.sub(r"<thinking>.*?</thinking>", "", text, flags=re.DOTALL)
+    text = _THINK_RE.sub("", text)
+    text = _THINKING_RE.sub("", text)
     return text
 
 
 def _extract_input_block(response: str) -> str:
     response = _strip_think_blocks(response or "")
-    m = re.findall(r"<INPUT>(.*?)</INPUT>", response, re.IGNORECASE | re.DOTALL)
+    m = _INPUT_RE.findall(response)
     if not m:
         return ""
     lines = [ln.rstrip() for ln in m[-1].strip().splitlines()]
@@ -59,22 +118,24 @@ def _extract_input_block(response: str) -> str:
 
 
 def _normalize_output(text: str) -> str:
-    return "\n".join(line.rstrip() for line in (text or "").rstrip().splitlines())
+    return _TRAIL_WS_RE.sub("", text or "").rstrip()
 
 
 class StandaloneABD:
-    def __init__(self) -> None:
+    def __init__(self, seed: Optional[int] = None) -> None:
         self.current: Optional[Dict[str, Any]] = None  # {program, expected_output, prompt}
+        self._ring = ShuffledRing(seed)
 
     async def generate(self) -> Tuple[str, Dict[str, Any]]:
         program, example_in = self._sample_program()
-        out, err = _execute_python(program, example_in)
+        out, err = await _execute_python(program, example_in)
         if err or not out.strip():
             # resample on degenerate
             program, example_in = self._fallback_program()
-            out, err = _execute_python(program, example_in)
-        prompt = PROMPT_TEMPLATE.format(program=program, output=_normalize_output(out))
-        self.current = {"program": program, "expected_output": _normalize_output(out), "prompt": prompt}
+            out, err = await _execute_python(program, example_in)
+        expected = _normalize_output(out)
+        prompt = "".join((_PROMPT_HEAD, program, _PROMPT_MID, expected, _PROMPT_TAIL))
+        self.current = {"program": program, "expected_output": expected, "prompt": prompt}
         return prompt, self.current
 
     async def evaluate(self, agent_text: str) -> Tuple[float, Dict[str, Any]]:
@@ -85,44 +146,25 @@ class StandaloneABD:
             return 0.0, {"error": "No <INPUT> block found"}
         prog = self.current["program"]
         expected = self.current["expected_output"]
-        out, err = _execute_python(prog, gen_input)
+        out, err = await _execute_python(prog, gen_input)
         if err:
             return 0.0, {"error": err, "generated_output": out}
-        ok = _normalize_output(out) == _normalize_output(expected)
+        # ``expected`` was normalized by generate().
+        got = _normalize_output(out)
+        ok = got == expected
         return (1.0 if ok else 0.0), {
             "outputs_match": ok,
             "generated_input": gen_input,
-            "generated_output": _normalize_output(out),
+            "generated_output": got,
             "expected_output": expected,
         }
 
     # ----------------------------- Program pool ---------------------------- #
     def _sample_program(self) -> Tuple[str, str]:
-        pool = [
-            (
-                "n = int(input())\nprint(n*n)",
-                "7\n",
-            ),
-            (
-                "a,b = map(int, input().split())\nprint(a+b)\nprint(a*b)",
-                "3 4\n",
-            ),
-            (
-                "import sys\nlines = sys.stdin.read().strip().split()\nprint(sum(map(int, lines)))",
-                "5 6 7\n",
-            ),
-            (
-                "s = input().strip()\nprint(s[::-1])",
-                "abcde\n",
-            ),
-        ]
-        return random.choice(pool)
+        return _PROGRAM_POOL[self._ring.next_index(len(_PROGRAM_POOL))]
 
     def _fallback_program(self) -> Tuple[str, str]:
-        return (
-            "x = int(input())\nprint(x+1)",
-            "9\n",
-        )
+        return _FALLBACK_PROGRAM
 
 
 # --------------------------- Server wrapper ------------------------------- #
@@ -141,14 +183,15 @@ class AbdEnvInstance:
 
     async def step(self, action: str) -> Tuple[str, float, bool, dict]:
         score, info = await self.env.evaluate(action)
-        obs = f"Score: {score}. Details: {info}"
+        # Keep the observation small; the full details travel in ``info``.
+        obs = f"Score: {score}. Outputs match: {bool(info.get('outputs_match'))}"
         return obs, score, True, info
 
 
 class AbdEnvServer:
-    def __init__(self) -> None:
+    def __init__(self, max_envs: int = 10_000) -> None:
         self._max_id: int = 0
-        self.envs: Dict[int, AbdEnvInstance] = {}
+        self.envs: LRUEnvCache[AbdEnvInstance] = LRUEnvCache(max_envs)
 
     async def create(self) -> int:
         env_idx = self._max_id
@@ -165,5 +208,8 @@ class AbdEnvServer:
     async def reset(self, env_idx: int) -> str:
         return await self.envs[env_idx].reset()
 
+    async def close(self, env_idx: int) -> bool:
+        return self.envs.pop(env_idx, None) is not None
+
 
 abd_env_server = AbdEnvServer() 
\ No newline at end of file
@@ -0,0 +1,14 @@
+from pydantic import BaseModel
+
+
+class StepQuery(BaseModel):
+    model_config = {"extra": "ignore"}
+
+    env_idx: int
+    action: str
+
+
+class ResetQuery(BaseModel):
+    model_config = {"extra": "ignore"}
+
+    env_idx: int
@@ -1,10 +1,24 @@
-from typing import List
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, List
 
 from fastapi import FastAPI
+from fastapi.responses import ORJSONResponse
 
 from .abd_environment import abd_env_server
+from .abd_model import ResetQuery, StepQuery
+from .worker_pool import close_pool
 
-app = FastAPI()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI) -> AsyncIterator[None]:
+    # The worker pool only starts if a run needs it (see _execute_python).
+    try:
+        yield
+    finally:
+        close_pool()
+
+
+app = FastAPI(default_response_class=ORJSONResponse, lifespan=lifespan)
 
 @app.get("/", response_model=str)
 def ok():
@@ -20,16 +34,18 @@ async def create():
     return {"id": env}
 
 @app.get("/observation", response_model=str)
-async def observation(id: int):
-    return await abd_env_server.observation(id)
+async def observation(env_idx: int):
+    return await abd_env_server.observation(env_idx)
 
 @app.post("/step")
-async def step(payload: dict):
-    id_ = int(payload["id"]) ; action = payload["action"]
-    obs, reward, done, info = await abd_env_server.step(id_, action)
+async def step(body: StepQuery):
+    obs, reward, done, info = await abd_env_server.step(body.env_idx, body.action)
     return {"observation": obs, "reward": reward, "done": done, "info": info}
 
 @app.post("/reset", response_model=str)
-async def reset(payload: dict):
-    id_ = int(payload["id"]) 
-    return await abd_env_server.reset(id_) 
\ No newline at end of file
+async def reset(body: ResetQuery):
+    return await abd_env_server.reset(body.env_idx)
+
+@app.delete("/env/{id}", response_model=dict)
+async def close(id: int):
+    return {"id": id, "closed": await abd_env_server.close(id)}
@@ -0,0 +1,45 @@
+"""
+Pregenerated challenges shared by the envs of one server.
+
+Building a challenge (a VM program and its test cases, a SAT formula, ...) is
+the expensive part of a reset, and challenges need not be unique per env. A
+``ChallengePool`` keeps up to ``size`` of them ready, refilled by a background
+task whenever resets take some, so resets usually just pop one.
+"""
+from __future__ import annotations
+
+import asyncio
+from collections import deque
+from typing import Any, Callable, Deque, Dict, Optional
+
+
+class ChallengePool:
+    def __init__(self, make_env: Callable[[], Any], size: int = 64) -> None:
+        # Any env with an ``async generate() -> (prompt, challenge)`` method.
+        self._env = make_env()
+        self.size = size
+        self._ready: Deque[Dict[str, Any]] = deque()
+        self._wanted: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        """Start the refill task on the running loop (no-op once started)."""
+        if self._task is None or self._task.done():
+            self._wanted = asyncio.Event()
+            self._task = asyncio.get_running_loop().create_task(self._refill())
+
+    def take(self) -> Optional[Dict[str, Any]]:
+        """Return a ready challenge, or None if the pool is empty."""
+        if self._wanted is not None:
+            self._wanted.set()
+        return self._ready.popleft() if self._ready else None
+
+    async def _refill(self) -> None:
+        while True:
+            while len(self._ready) < self.size:
+                _, challenge = await self._env.generate()
+                self._ready.append(challenge)
+                # Generation does not await: give requests a turn between challenges.
+                await asyncio.sleep(0)
+            self._wanted.clear()
+            await self._wanted.wait()
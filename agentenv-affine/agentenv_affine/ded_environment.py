@@ -6,18 +6,28 @@ Standalone DedEnvServer for DED (without dependency on affine package).
 """
 from __future__ import annotations
 
+import ast
 import asyncio
 import json
-import random
 import re
-import subprocess
 import time
-from typing import Dict, Optional, Tuple, Any
+import traceback
+from typing import Dict, List, Optional, Tuple, Any, Union
 
 from datasets import load_dataset
 
+from .env_cache import LRUEnvCache
+from .shuffled_ring import ShuffledRing
+from .worker_pool import get_pool
+
 # ------------------------------- Utils -------------------------------- #
 
+_THINK_RE = re.compile(r"<think>.*?</think>", re.DOTALL | re.IGNORECASE)
+_FENCE_RE = re.compile(r"```(?:python)?\n(.*?)```", re.DOTALL | re.IGNORECASE)
+# Whitespace ending a line (or the buffer).
+_TRAIL_WS_RE = re.compile(rb"[ \t\r\f\v]+(?=\n|\Z)")
+
+
 def _to_str(x) -> str:
     if isinstance(x, str):
         return x
@@ -28,16 +38,48 @@ def _to_str(x) -> str:
     return json.dumps(x, ensure_ascii=False)
 
 
-def _normalize(text: str) -> str:
-    return "\n".join(line.rstrip() for line in (text or "").rstrip().splitlines())
+def _normalize_bytes(data: bytes) -> bytes:
+    # Strip trailing whitespace of every line, then trailing blank lines, in two C-level passes.
+    return _TRAIL_WS_RE.sub(b"", data or b"").rstrip()
+
+
+def _check_case(inp: str, exp: Optional[str], out: bytes, err: bytes) -> Dict[str, Any]:
+    # Compare raw bytes; only decode what the details of a failure need.
+    ok_run = not err.strip()
+    out_norm = _normalize_bytes(out)
+    exp_norm = _normalize_bytes(exp.encode()) if exp is not None else None
+    correct = ok_run and (exp_norm is None or out_norm == exp_norm)
+    exp_text = exp_norm.decode(errors="ignore") if exp_norm is not None else None
+    return {
+        "input": inp,
+        "expected": exp_text,
+        "got": exp_text if correct and exp_text is not None else out_norm.decode(errors="ignore"),
+        "stderr": err.strip().decode(errors="ignore"),
+        "passed": bool(correct),
+    }
+
+
+def _decode_cases(ver_raw: Any) -> Optional[List[Dict[str, Any]]]:
+    """Return the test cases of a verification_info/test_cases field, or None if unusable."""
+    ver_json = ver_raw
+    if isinstance(ver_raw, str):
+        try:
+            ver_json = json.loads(ver_raw)
+        except json.JSONDecodeError:
+            try:
+                ver_json = ast.literal_eval(ver_raw)  # legacy dataset format
+            except Exception:
+                return None
+    cases = ver_json.get("test_cases") if isinstance(ver_json, dict) else None
+    return cases or None
 
 
 def _strip_fences(reply: Optional[str]) -> str:
     text = reply or ""
     # remove <think>...</think> tags
-    text = re.sub(r"<think>.*?</think>", "", text, flags=re.DOTALL | re.IGNORECASE)
+    text = _THINK_RE.sub("", text)
     # extract last ```python ... ``` or ``` ... ``` block
-    code_blocks = re.findall(r"```(?:python)?\n(.*?)```", text, flags=re.DOTALL | re.IGNORECASE)
+    code_blocks = _FENCE_RE.findall(text)
     if code_blocks:
         return code_blocks[-1].strip()
     return text.strip()
@@ -47,18 +89,14 @@ class SimpleProgramExecutor:
     def __init__(self, timeout_sec: float = 5.0):
         self.timeout_sec = timeout_sec
 
-    def execute(self, code: str, stdin: str = "") -> Tuple[str, str]:
-        try:
-            p = subprocess.run(
-                ["python3", "-c", code],
-                input=stdin.encode(),
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                timeout=self.timeout_sec,
-            )
-            return p.stdout.decode(errors="ignore"), p.stderr.decode(errors="ignore")
-        except subprocess.TimeoutExpired:
-            return "", "TIMEOUT"
+    def compile(self, code: str) -> Union[str, bytes]:
+        return get_pool().compile(code)
+
+    async def execute(self, code: Union[str, bytes], stdin: str = "") -> Tuple[bytes, bytes]:
+        return await get_pool().submit(code, stdin, self.timeout_sec)
+
+    async def call_batch(self, code: Union[str, bytes], calls: List[Tuple[Any, Any]]) -> List[Tuple[bytes, bytes]]:
+        return await get_pool().call_batch(code, calls, self.timeout_sec)
 
 
 # ------------------------------- Env -------------------------------- #
@@ -74,45 +112,83 @@ EXTRA_HINT = (
 )
 
 
+class _DatasetHolder:
+    """Dataset rows shared by every DedStandaloneEnv of the process."""
+
+    # Materialized rows: the prompt and the already decoded test cases.
+    rows: Optional[List[Dict[str, Any]]] = None
+    lock: Optional[asyncio.Lock] = None
+
+    @staticmethod
+    def load() -> List[Dict[str, Any]]:
+        ds = load_dataset("satpalsr/rl-python", split="train")
+        rows = []
+        for r in ds:
+            cases = _decode_cases(r.get("verification_info") or r.get("test_cases"))
+            if cases is None:
+                continue  # malformed or without public tests: could never be solved
+            rows.append({"prompt": r.get("prompt"), "_cases": cases})
+        return rows
+
+
 class DedStandaloneEnv:
-    def __init__(self) -> None:
-        self._ds = None
+    def __init__(
+        self, max_samples: Optional[int] = None, seed: Optional[int] = None, full_details: bool = False
+    ) -> None:
+        self._cache: Optional[List[Dict[str, Any]]] = None
+        # Run every test case even after one failed (e.g. to report them all).
+        self._full_details = full_details
+        self._max_samples = max_samples
+        self._ring = ShuffledRing(seed)
         self._executor = SimpleProgramExecutor(timeout_sec=8.0)
 
-    def _ensure_ds(self):
-        if self._ds is None:
-            self._ds = load_dataset("satpalsr/rl-python", split="train")
+    async def _ensure_ds(self):
+        if self._cache is not None:
+            return
+        # Loading takes seconds: do it off the event loop, once per process.
+        if _DatasetHolder.rows is None:
+            if _DatasetHolder.lock is None:
+                _DatasetHolder.lock = asyncio.Lock()
+            async with _DatasetHolder.lock:
+                if _DatasetHolder.rows is None:
+                    _DatasetHolder.rows = await asyncio.to_thread(_DatasetHolder.load)
+        rows = _DatasetHolder.rows
+        if self._max_samples is not None and self._max_samples < len(rows):
+            rows = rows[: self._max_samples]
+        self._cache = rows
+
+    def _next_sample(self) -> Dict[str, Any]:
+        return self._cache[self._ring.next_index(len(self._cache))]
 
     async def generate(self) -> Dict[str, Any]:
-        self._ensure_ds()
-        sample = self._ds[random.randrange(0, len(self._ds))]
-        prompt = (sample.get("prompt", "").rstrip() or "Solve the problem.") + EXTRA_HINT
-        sample = dict(sample)
-        sample["timestamp"] = time.time()
-        return {"prompt": prompt, "extra": sample}
+        await self._ensure_ds()
+        sample = self._next_sample()
+        prompt = ((sample["prompt"] or "").rstrip() or "Solve the problem.") + EXTRA_HINT
+        return {"prompt": prompt, "extra": dict(sample, timestamp=time.time())}
 
     async def evaluate(self, challenge: Dict[str, Any], raw_reply: str) -> Tuple[float, Dict[str, Any]]:
         program = _strip_fences(raw_reply)
         sample = challenge.get("extra", {})
-        ver_raw = sample.get("verification_info") or sample.get("test_cases")
-        try:
-            if isinstance(ver_raw, str):
-                try:
-                    ver_json = json.loads(ver_raw)
-                except json.JSONDecodeError:
-                    ver_json = eval(ver_raw, {"__builtins__": {}}, {})  # legacy dataset format
-            else:
-                ver_json = ver_raw
-        except Exception as err:
-            return 0.0, {"error": f"Invalid verification_info: {err}"}
-
-        cases = (ver_json or {}).get("test_cases") if isinstance(ver_json, dict) else None
+        cases = sample.get("_cases")
+        if cases is None:
+            # Challenge not built by generate(): decode its raw verification data.
+            cases = _decode_cases(sample.get("verification_info") or sample.get("test_cases"))
         if not cases:
             return 0.0, {"error": "No public test cases available"}
 
-        passed, total = 0, len(cases)
-        details = []
-        for i, case in enumerate(cases, start=1):
+        # Parse/compile the submission once; every case reuses it.
+        compile_err = b""
+        try:
+            compiled = self._executor.compile(program)
+        except (SyntaxError, ValueError, MemoryError, RecursionError, OverflowError) as e:
+            # Whatever `python3 -c` would have reported while compiling.
+            compiled = None
+            compile_err = "".join(traceback.format_exception_only(type(e), e)).encode()
+
+        # (position, stdin, expected) and (position, (fn, args), expected)
+        stdin_cases: List[Tuple[int, str, str]] = []
+        call_cases: List[Tuple[int, Tuple[Any, Any], str]] = []
+        for pos, case in enumerate(cases):
             ctype = case.get("type")
             raw_inp = case.get("input")
             raw_exp = case.get("output")
@@ -121,38 +197,49 @@ class DedStandaloneEnv:
                 inp = _to_str(raw_inp)
                 if not inp.endswith("\n"):
                     inp += "\n"
-                exec_prog = program
-                exp = _to_str(raw_exp)
+                stdin_cases.append((pos, inp, _to_str(raw_exp)))
             elif ctype == "function_call":
-                fn = case.get("fn_name")
-                args = case.get("input", [])
-                exec_prog = (
-                    program
-                    + "\n"
-                    + "if __name__ == '__main__':\n"
-                    + f"    result = {fn}(*{args!r})\n"
-                    + "    print(result)"
-                )
-                inp = ""
                 exp = _to_str(raw_exp[0]) if isinstance(raw_exp, list) and raw_exp else _to_str(raw_exp)
-            else:
-                total -= 1
-                continue
-
-            out, err = self._executor.execute(exec_prog, inp)
-            ok_run = not (err or "").strip()
-            out_norm = _normalize(out)
-            exp_norm = _normalize(exp) if exp is not None else None
-            correct = ok_run and (exp_norm is None or out_norm == exp_norm)
-            if correct:
-                passed += 1
-            details.append({
-                "input": inp,
-                "expected": exp_norm,
-                "got": out_norm,
-                "stderr": (err or "").strip(),
-                "passed": bool(correct),
-            })
+                call_cases.append((pos, (case.get("fn_name"), case.get("input", [])), exp))
+
+        async def run_stdin(inp: str) -> List[Tuple[bytes, bytes]]:
+            if compiled is None:
+                return [(b"", compile_err)]
+            return [await self._executor.execute(compiled, inp)]
+
+        async def run_calls() -> List[Tuple[bytes, bytes]]:
+            if compiled is None:
+                return [(b"", compile_err)] * len(call_cases)
+            return await self._executor.call_batch(compiled, [call for _, call, _ in call_cases])
+
+        # stdin cases are independent and run concurrently; function_call cases
+        # share one loaded program and call the function directly. Each task
+        # maps to the (position, input, expected) of the cases it answers.
+        tasks = {asyncio.ensure_future(run_stdin(inp)): [(pos, inp, exp)] for pos, inp, exp in stdin_cases}
+        if call_cases:
+            tasks[asyncio.ensure_future(run_calls())] = [(pos, "", exp) for pos, _, exp in call_cases]
+
+        # The score is all-or-nothing: unless full details were asked for,
+        # stop at the first failing case and cancel the others. Cases still
+        # waiting for a worker are dropped; those already running finish in
+        # the background, so their workers are reused (see WorkerPool._run_job).
+        checked: List[Tuple[int, Dict[str, Any]]] = []
+        failed = False
+        pending = set(tasks)
+        try:
+            while pending and not failed:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    for (pos, inp, exp), (out, err) in zip(tasks[task], task.result()):
+                        detail = _check_case(inp, exp, out, err)
+                        checked.append((pos, detail))
+                        failed = failed or (not detail["passed"] and not self._full_details)
+        finally:
+            for task in pending:
+                task.cancel()
+        checked.sort(key=lambda c: c[0])
+        details = [detail for _, detail in checked]
+        passed, total = sum(d["passed"] for d in details), len(stdin_cases) + len(call_cases)
 
         score = 1.0 if passed == total else 0.0
         return score, {"passed": passed, "total": total, "tests": details}
@@ -181,14 +268,15 @@ class _DedEnvInstance:
     async def step(self, action: str) -> Tuple[str, float, bool, dict]:
         chal = await self.ensure_challenge()
         score, feedback = await self.env.evaluate(chal, action)
-        obs = f"Score: {score}. Details: {feedback}"
+        # Keep the observation small; the full details travel in ``info``.
+        obs = f"Score: {score}. Passed {feedback.get('passed', 0)}/{feedback.get('total', 0)}"
         return obs, float(score), True, {"extra": feedback}
 
 
 class DedEnvServer:
-    def __init__(self) -> None:
+    def __init__(self, max_envs: int = 10_000) -> None:
         self._max_id: int = 0
-        self.env: Dict[int, _DedEnvInstance] = {}
+        self.env: LRUEnvCache[_DedEnvInstance] = LRUEnvCache(max_envs)
         self._lock = asyncio.Lock()
 
     async def create(self, id: int = 0) -> int:
@@ -207,5 +295,8 @@ class DedEnvServer:
     async def step(self, env_idx: int, action: str) -> Tuple[str, float, bool, dict]:
         return await self.env[env_idx].step(action)
 
+    async def close(self, env_idx: int) -> bool:
+        return self.env.pop(env_idx, None) is not None
+
 
 ded_env_server = DedEnvServer() 
\ No newline at end of file
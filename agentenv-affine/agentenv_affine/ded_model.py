@@ -4,20 +4,28 @@ from pydantic import BaseModel
 
 
 class CreateQuery(BaseModel):
+    model_config = {"extra": "ignore"}
+
     id: int = 0
 
 
 class StepQuery(BaseModel):
+    model_config = {"extra": "ignore"}
+
     env_idx: int
     action: str
 
 
 class StepResponse(BaseModel):
+    model_config = {"extra": "ignore"}
+
     observation: str
     reward: float
     done: bool
 
 
 class ResetQuery(BaseModel):
+    model_config = {"extra": "ignore"}
+
     env_idx: int
     id: Optional[int] = None 
\ No newline at end of file
@@ -1,13 +1,28 @@
 """
 FastAPI Server for Affine DED
 """
-from typing import List
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, List
 
 from fastapi import FastAPI
+from fastapi.responses import ORJSONResponse
 
 from .ded_environment import ded_env_server
+from .ded_model import ResetQuery, StepQuery
+from .worker_pool import close_pool, get_pool
 
-app = FastAPI()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI) -> AsyncIterator[None]:
+    # Start the warm workers before any request is served.
+    get_pool()
+    try:
+        yield
+    finally:
+        close_pool()
+
+
+app = FastAPI(default_response_class=ORJSONResponse, lifespan=lifespan)
 
 
 @app.get("/", response_model=str)
@@ -27,19 +42,21 @@ async def create():
 
 
 @app.get("/observation", response_model=str)
-async def observation(id: int):
-    return await ded_env_server.observation(id)
+async def observation(env_idx: int):
+    return await ded_env_server.observation(env_idx)
 
 
 @app.post("/step")
-async def step(payload: dict):
-    id_ = int(payload.get("id"))
-    action = payload.get("action", "")
-    observation, reward, done, _ = await ded_env_server.step(id_, action)
-    return {"observation": observation, "reward": reward, "done": done}
+async def step(body: StepQuery):
+    observation, reward, done, info = await ded_env_server.step(body.env_idx, body.action)
+    return {"observation": observation, "reward": reward, "done": done, "info": info}
 
 
 @app.post("/reset", response_model=str)
-async def reset(payload: dict):
-    id_ = int(payload.get("id"))
-    return await ded_env_server.reset(id_, None) 
\ No newline at end of file
+async def reset(body: ResetQuery):
+    return await ded_env_server.reset(body.env_idx, body.id)
+
+
+@app.delete("/env/{id}", response_model=dict)
+async def close(id: int):
+    return {"id": id, "closed": await ded_env_server.close(id)}
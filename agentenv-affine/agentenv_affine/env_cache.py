@@ -0,0 +1,50 @@
+"""
+Bounded env registry shared by the env servers.
+
+Clients may create envs and never release them (see ``DELETE /env/{id}``), so
+the servers keep at most ``capacity`` of them and evict the least recently used
+one when a new env is created past that limit.
+"""
+from __future__ import annotations
+
+from collections import OrderedDict
+from typing import Generic, Iterator, KeysView, Optional, TypeVar
+
+T = TypeVar("T")
+
+
+class LRUEnvCache(Generic[T]):
+    def __init__(self, capacity: int = 10_000) -> None:
+        if capacity < 1:
+            raise ValueError("capacity must be at least 1")
+        self.capacity = capacity
+        self._envs: "OrderedDict[int, T]" = OrderedDict()
+
+    def __getitem__(self, env_idx: int) -> T:
+        env = self._envs[env_idx]
+        self._envs.move_to_end(env_idx)
+        return env
+
+    def __setitem__(self, env_idx: int, env: T) -> None:
+        self._envs[env_idx] = env
+        self._envs.move_to_end(env_idx)
+        while len(self._envs) > self.capacity:
+            self._envs.popitem(last=False)
+
+    def __delitem__(self, env_idx: int) -> None:
+        del self._envs[env_idx]
+
+    def __contains__(self, env_idx: object) -> bool:
+        return env_idx in self._envs
+
+    def __len__(self) -> int:
+        return len(self._envs)
+
+    def __iter__(self) -> Iterator[int]:
+        return iter(self._envs)
+
+    def keys(self) -> KeysView[int]:
+        return self._envs.keys()
+
+    def pop(self, env_idx: int, default: Optional[T] = None) -> Optional[T]:
+        return self._envs.pop(env_idx, default)
@@ -1,6 +1,7 @@
 from typing import Any, Mapping, Dict
 
 import requests
+from requests.adapters import HTTPAdapter
 from requests.exceptions import RequestException
 
 from agentenv.controller import BaseEnvClient, BaseTask
@@ -26,21 +27,26 @@ class AffineHvmEnvClient(BaseEnvClient):
         self.env_server_base = env_server_base
         self.timeout = timeout
         self.data_len = data_len
+        # Reuse connections across create/step/observe/reset calls.
+        self._session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=32, pool_maxsize=32, max_retries=0)
+        self._session.mount("http://", adapter)
+        self._session.mount("https://", adapter)
 
-        ok = requests.post(
+        ok = self._session.post(
             f"{self.env_server_base}/create",
             timeout=self.timeout,
         )
         if ok.status_code != 200:
             raise RequestException(f"Failed to create environment: {ok}")
-        self.env_id = ok.json()
+        self.env_id = ok.json()["id"]
 
     def __len__(self):
         return self.data_len
 
     def _post(self, path: str, data: Dict[str, Any]) -> Dict[str, Any]:
         data["env_idx"] = self.env_id
-        res = requests.post(
+        res = self._session.post(
             f"{self.env_server_base}/{path}",
             json=data,
             timeout=self.timeout,
@@ -49,7 +55,7 @@ class AffineHvmEnvClient(BaseEnvClient):
         return res.json()
 
     def _get(self, path: str) -> Dict[str, Any]:
-        res = requests.get(
+        res = self._session.get(
             f"{self.env_server_base}/{path}?env_idx={self.env_id}",
             timeout=self.timeout,
         )
@@ -4,9 +4,47 @@ parse <HOLES> depuis la réponse de l'agent et évalue la sortie.
 """
 from __future__ import annotations
 
+import operator
 import random
 import re
-from typing import Any, Dict, List, Optional, Tuple
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from .challenge_pool import ChallengePool
+
+# Opening/closing <HOLES> tags; blocks are cut out between them by hand so a
+# response full of unclosed tags is still scanned in linear time.
+_HOLES_TAG_RE = re.compile(r"<(/?)HOLES>", re.IGNORECASE)
+# One line of a <HOLES> block: `?name = value`, a `#` comment, blank, or
+# anything else (group 3, non-empty), which makes the whole block invalid.
+# Lines end where str.splitlines() would end them, not only at \n.
+_LINE_BREAKS = "\n\r\x0b\x0c\x1c\x1d\x1e\x85\u2028\u2029"
+_HOLE_LINE_RE = re.compile(
+    r"(?:\A|(?<=[{br}]))[^\S{br}]*"
+    r"(?:(\?[a-zA-Z]\w*)[^\S{br}]*=[^\S{br}]*(-?\d+)[^\S{br}]*(?=[{br}]|\Z)"
+    r"|#[^{br}]*|([^{br}]*))".format(br=_LINE_BREAKS)
+)
+
+# Static parts of the prompt rendered by StandaloneHVM._render_prompt.
+_HVM_PROMPT_HEADER = (
+    "You are given a small stack-based Virtual Machine program with UNKNOWN constants (holes).\n"
+    "Instruction set:\n"
+    "  PUSH n       ; push integer n (n can also be a hole like ?a)\n"
+    "  LOAD i       ; push i-th input integer (0-based)\n"
+    "  ADD SUB MUL DIV MOD\n"
+    "  DUP SWAP POP\n"
+    "  JMP k        ; absolute jump\n"
+    "  JMPZ k       ; jump if top==0\n"
+    "  JMPNZ k      ; jump if top!=0\n"
+    "  PRINT\n"
+    "  HALT\n\n"
+)
+_HVM_PROMPT_FOOTER = (
+    "Return ONLY the hole mapping in this exact format:\n\n"
+    "<HOLES>\n?a=3\n?b=-1\n?c=42\n</HOLES>\n"
+)
+
+# Upper bound on the VM results _forge_io remembers while forging one challenge.
+_FORGE_MEMO_SIZE = 256
 
 
 class StandaloneHVM:
@@ -42,10 +80,11 @@ class StandaloneHVM:
             if v not in dom:
                 return 0.0, {"error": f"value {v} for {h} outside domain {dom}"}
 
+        specialized = _specialize(spec, holes)
         details: List[Dict[str, Any]] = []
         passed = 0
         for inp, exp in zip(inputs, expected):
-            ok, out = self._run_vm_local(spec, holes, inp)
+            ok, out = self._run_vm_local(spec, holes, inp, specialized)
             exp_c = self._canon(exp)
             out_c = self._canon(out) if ok else ""
             correct = ok and (out_c == exp_c)
@@ -57,8 +96,9 @@ class StandaloneHVM:
                 "got_canon": out_c,
                 "passed": bool(correct),
             })
-            if correct:
-                passed += 1
+            if not correct:
+                break  # one failing case already scores 0
+            passed += 1
         score = 1.0 if passed == len(inputs) else 0.0
         return score, {"passed": passed, "total": len(inputs), "details": details}
 
@@ -118,32 +158,61 @@ class StandaloneHVM:
         else:
             code.append(("HALT", None))
 
+        hole_idx = {name: i for i, name in enumerate(holes)}
         return {
             "code": code,
+            "code_int": _encode(code, hole_idx),
             "holes": holes,
+            "hole_idx": hole_idx,
             "hole_domains": hole_domains,
             "max_steps": 8000 if hard else 4000,
             "stack_cap": 256,
         }
 
-    def _forge_io(self, prog: Dict[str, Any], n_cases: int) -> Tuple[List[List[int]], List[str]]:
+    def _forge_io(
+        self, prog: Dict[str, Any], n_cases: int, max_attempts: int = 8
+    ) -> Tuple[List[List[int]], List[str]]:
         rng = self._rng
+        uses_k = any(op == "LOAD" and arg == "2" for op, arg in prog["code"])
+        # VM runs are pure: memoize them for the duration of this call, so that
+        # redrawn cases and re-drawn assignments never run the same thing twice.
+        memo: Dict[Tuple[Tuple[Tuple[str, int], ...], Tuple[int, ...]], Tuple[bool, str]] = {}
+
+        def run(case: List[int]) -> Tuple[bool, str]:
+            key = (chosen_key, tuple(case))
+            res = memo.get(key)
+            if res is None:
+                res = self._run_vm_local(prog, chosen, case, specialized)
+                if len(memo) < _FORGE_MEMO_SIZE:
+                    memo[key] = res
+            return res
+
         chosen = {h: rng.choice(dom) for h, dom in prog["hole_domains"].items()}
+        chosen_key = tuple(sorted(chosen.items()))
+        specialized = _specialize(prog, chosen)
         inputs: List[List[int]] = []
         expected: List[str] = []
-        for _ in range(n_cases):
+        attempts = 0
+        while len(inputs) < n_cases:
+            if attempts >= max_attempts:
+                # This assignment keeps failing: draw another one and recompute
+                # the cases found so far, dropping those it cannot run.
+                chosen = {h: rng.choice(dom) for h, dom in prog["hole_domains"].items()}
+                chosen_key = tuple(sorted(chosen.items()))
+                specialized = _specialize(prog, chosen)
+                kept = [(case, run(case)) for case in inputs]
+                inputs = [case for case, (ok, out) in kept if ok and out != ""]
+                expected = [out for _, (ok, out) in kept if ok and out != ""]
+                attempts = 0
+                continue
+            attempts += 1
             a = rng.randint(-8, 8)
             b = rng.randint(-8, 8)
-            if any(op == "LOAD" and arg == "2" for op, arg in prog["code"]):
-                k = rng.randint(1, 8)
-                case = [a, b, k]
-            else:
-                case = [a, b]
-            ok, out = self._run_vm_local(prog, chosen, case)
-            if not ok or out == "":
-                return self._forge_io(prog, n_cases)
-            inputs.append(case)
-            expected.append(out)
+            case = [a, b, rng.randint(1, 8)] if uses_k else [a, b]
+            ok, out = run(case)
+            if ok and out != "":
+                inputs.append(case)
+                expected.append(out)
         return inputs, expected
 
     def _render_prompt(self, prog: Dict[str, Any], inputs: List[List[int]], expected: List[str]) -> str:
@@ -165,157 +234,315 @@ class StandaloneHVM:
         for i, (inp, out) in enumerate(zip(inputs, expected)):
             case_lines.append(f"Case #{i}: input={inp}  expected stdout=\n---\n{out}\n---")
 
-        return (
-            "You are given a small stack-based Virtual Machine program with UNKNOWN constants (holes).\n"
-            "Instruction set:\n"
-            "  PUSH n       ; push integer n (n can also be a hole like ?a)\n"
-            "  LOAD i       ; push i-th input integer (0-based)\n"
-            "  ADD SUB MUL DIV MOD\n"
-            "  DUP SWAP POP\n"
-            "  JMP k        ; absolute jump\n"
-            "  JMPZ k       ; jump if top==0\n"
-            "  JMPNZ k      ; jump if top!=0\n"
-            "  PRINT\n"
-            "  HALT\n\n"
-            f"Program:\n{render_program()}\n\n"
-            "Holes and domains:\n- " + "\n- ".join(hole_lines) + "\n\n"
-            "Test cases:\n" + "\n".join(case_lines) + "\n\n"
-            "Return ONLY the hole mapping in this exact format:\n\n"
-            "<HOLES>\n?a=3\n?b=-1\n?c=42\n</HOLES>\n"
-        )
+        return "".join((
+            _HVM_PROMPT_HEADER,
+            "Program:\n", render_program(), "\n\n",
+            "Holes and domains:\n- ", "\n- ".join(hole_lines), "\n\n",
+            "Test cases:\n", "\n".join(case_lines), "\n\n",
+            _HVM_PROMPT_FOOTER,
+        ))
 
     # --------------------------- VM execution ----------------------------- #
-    def _run_vm_local(self, prog: Dict[str, Any], holes: Dict[str, int], inputs: List[int]) -> Tuple[bool, str]:
-        ip = 0
-        steps = 0
-        stack: List[int] = []
-        out: List[str] = []
-        code = prog["code"]
-        max_steps = int(prog["max_steps"])
-        cap = int(prog["stack_cap"])
-
-        def push(v: int) -> bool:
-            if len(stack) >= cap:
-                return False
-            stack.append(int(v))
-            return True
-
-        while True:
-            if steps > max_steps or ip < 0 or ip >= len(code):
-                return (False, "")
-            op, arg = code[ip]
-            steps += 1
-
-            if op == "PUSH":
-                if arg is None:
-                    return (False, "")
-                if isinstance(arg, str) and arg.startswith("?"):
-                    if arg not in holes or not push(holes[arg]):
-                        return (False, "")
-                else:
-                    if not push(int(arg)):
-                        return (False, "")
-                ip += 1
-            elif op == "LOAD":
-                idx = int(arg or -1)
-                if idx < 0 or idx >= len(inputs):
-                    return (False, "")
-                if not push(inputs[idx]):
-                    return (False, "")
-                ip += 1
-            elif op in ("ADD", "SUB", "MUL", "DIV", "MOD"):
-                if len(stack) < 2:
-                    return (False, "")
-                b = stack.pop(); a = stack.pop()
-                if op == "ADD":
-                    c = a + b
-                elif op == "SUB":
-                    c = a - b
-                elif op == "MUL":
-                    c = a * b
-                elif op == "DIV":
-                    if b == 0:
-                        return (False, "")
-                    c = int(a / b)
-                else:
-                    if b == 0:
-                        return (False, "")
-                    c = a % b
-                if not push(c):
-                    return (False, "")
-                ip += 1
-            elif op == "DUP":
-                if not stack or not push(stack[-1]):
-                    return (False, "")
-                ip += 1
-            elif op == "SWAP":
-                if len(stack) < 2:
-                    return (False, "")
-                stack[-1], stack[-2] = stack[-2], stack[-1]
-                ip += 1
-            elif op == "POP":
-                if not stack:
-                    return (False, "")
-                stack.pop(); ip += 1
-            elif op in ("JMP", "JMPZ", "JMPNZ"):
-                tgt_raw = arg
-                tgt = holes[tgt_raw] if (isinstance(tgt_raw, str) and tgt_raw.startswith("?")) else int(tgt_raw)
-                if op == "JMP":
-                    ip = tgt
-                else:
-                    if not stack:
-                        return (False, "")
-                    top = stack.pop()
-                    cond = (top == 0)
-                    if (op == "JMPZ" and cond) or (op == "JMPNZ" and not cond):
-                        ip = tgt
-                    else:
-                        ip += 1
-            elif op == "PRINT":
-                if not stack:
-                    return (False, "")
-                out.append(str(int(stack.pop())))
-                ip += 1
-            elif op == "HALT":
-                break
-            else:
-                return (False, "")
-        return (True, "\n".join(out))
+    def _run_vm_local(
+        self,
+        prog: Dict[str, Any],
+        holes: Dict[str, int],
+        inputs: List[int],
+        specialized: Optional[_Specialized] = None,
+    ) -> Tuple[bool, str]:
+        # ``specialized`` must come from _specialize(prog, holes) when given.
+        if specialized is None:
+            specialized = _specialize(prog, holes)
+        ops, args = _lower(specialized, inputs)
+        return _execute(ops, args, int(prog["max_steps"]), int(prog["stack_cap"]))
 
     def _parse_holes(self, text: str) -> Optional[Dict[str, int]]:
-        m = re.findall(r"<HOLES>\s*(.*?)\s*</HOLES>", text, flags=re.DOTALL | re.IGNORECASE)
-        if not m:
+        block = self._last_holes_block(text)
+        if block is None:
             return None
-        block = m[-1]
         out: Dict[str, int] = {}
-        for line in block.strip().splitlines():
-            line = line.strip()
-            if not line or line.startswith("#"):
-                continue
-            mm = re.match(r"(\?[a-zA-Z]\w*)\s*=\s*(-?\d+)$", line)
-            if not mm:
+        for mm in _HOLE_LINE_RE.finditer(block):
+            name, value, junk = mm.groups()
+            if junk:
                 return None
-            out[mm.group(1)] = int(mm.group(2))
+            if name is not None:
+                out[name] = int(value)
         return out
 
+    @staticmethod
+    def _last_holes_block(text: str) -> Optional[str]:
+        block = None
+        open_end = -1
+        for tag in _HOLES_TAG_RE.finditer(text):
+            if not tag.group(1):
+                open_end = tag.end()
+            elif open_end >= 0:
+                block = text[open_end:tag.start()]
+                open_end = -1
+        return block
+
     @staticmethod
     def _canon(s: str) -> str:
-        if s is None:
+        if not s:
             return ""
-        s = s.replace("\r\n", "\n").replace("\r", "\n")
-        if s.endswith("\n"):
-            s = s[:-1]
-        return "\n".join(line.rstrip() for line in s.split("\n"))
+        # splitlines() handles \r\n, \r and \n and drops the final line break.
+        return "\n".join([line.rstrip() for line in s.splitlines()])
+
+
+# ------------------------------ VM core --------------------------------- #
+# Programs are lowered to parallel lists of integer opcodes and integer
+# arguments (holes and inputs resolved) so the interpreter never looks at strings.
+(
+    _OP_PUSH, _OP_LOAD, _OP_ADD, _OP_SUB, _OP_MUL, _OP_DIV, _OP_MOD, _OP_DUP,
+    _OP_SWAP, _OP_POP, _OP_JMP, _OP_JMPZ, _OP_JMPNZ, _OP_PRINT, _OP_HALT, _OP_BAD,
+) = range(16)
+_OPCODES = {
+    "PUSH": _OP_PUSH, "LOAD": _OP_LOAD, "ADD": _OP_ADD, "SUB": _OP_SUB, "MUL": _OP_MUL,
+    "DIV": _OP_DIV, "MOD": _OP_MOD, "DUP": _OP_DUP, "SWAP": _OP_SWAP, "POP": _OP_POP,
+    "JMP": _OP_JMP, "JMPZ": _OP_JMPZ, "JMPNZ": _OP_JMPNZ, "PRINT": _OP_PRINT, "HALT": _OP_HALT,
+}
+_JUMPS = (_OP_JMP, _OP_JMPZ, _OP_JMPNZ)
+# Kinds of instruction arguments in the encoded program.
+_ARG_NONE, _ARG_INT, _ARG_HOLE = range(3)
+
+
+def _encode(
+    code: List[Tuple[str, Optional[str]]], hole_idx: Dict[str, int]
+) -> List[Tuple[int, int, int]]:
+    """
+    Map ``code`` to (opcode id, argument kind, value) triples. Literals are
+    parsed now; a hole argument keeps its position in ``hole_idx`` and is
+    resolved by ``_specialize``.
+    """
+    code_int: List[Tuple[int, int, int]] = []
+    for op, arg in code:
+        opc = _OPCODES.get(op, _OP_BAD)
+        kind, val = _ARG_NONE, 0
+        if opc == _OP_LOAD or opc == _OP_PUSH or opc in _JUMPS:
+            if opc == _OP_LOAD:
+                arg = arg or "-1"
+            if arg is None:
+                opc = _OP_BAD
+            elif arg.startswith("?"):
+                if arg in hole_idx and opc != _OP_LOAD:
+                    kind, val = _ARG_HOLE, hole_idx[arg]
+                else:
+                    opc = _OP_BAD
+            else:
+                try:
+                    kind, val = _ARG_INT, int(arg)
+                except ValueError:
+                    opc = _OP_BAD
+        code_int.append((opc, kind, val))
+    return code_int
+
+
+# A program specialized for one hole assignment: opcode ids, their resolved
+# arguments and the addresses of its LOAD instructions.
+_Specialized = Tuple[List[int], List[int], Tuple[int, ...]]
+
+
+def _specialize(prog: Dict[str, Any], holes: Dict[str, int]) -> _Specialized:
+    """
+    Resolve the arguments of ``prog`` that do not depend on the inputs: holes
+    take their values from ``holes`` and out-of-program jumps go to -1.
+    Instructions that could never run become _OP_BAD; LOADs are left to
+    ``_lower``. Done once per assignment, then shared by all its runs.
+    """
+    code_int = prog.get("code_int")
+    if code_int is None:
+        code_int = _encode(prog["code"], {name: i for i, name in enumerate(prog["holes"])})
+    hole_vals = [int(holes[name]) if name in holes else None for name in prog["holes"]]
+    n = len(code_int)
+    ops: List[int] = []
+    args: List[int] = []
+    loads: List[int] = []
+    for opc, kind, val in code_int:
+        if kind == _ARG_HOLE:
+            val = hole_vals[val]
+            if val is None:
+                opc, val = _OP_BAD, 0
+        if opc == _OP_LOAD:
+            loads.append(len(ops))
+        elif opc in _JUMPS and not 0 <= val < n:
+            val = -1  # jumping out of the program fails
+        ops.append(opc)
+        args.append(val)
+    return ops, args, tuple(loads)
+
+
+def _lower(spec: _Specialized, inputs: List[int]) -> Tuple[List[int], List[int]]:
+    """Turn every LOAD of a specialized program into a PUSH of its input."""
+    ops, args, loads = spec
+    if not loads:
+        return ops, args  # runs never modify the code: share it
+    ops = ops.copy()
+    args = args.copy()
+    for ip in loads:
+        i = args[ip]
+        if 0 <= i < len(inputs):
+            ops[ip], args[ip] = _OP_PUSH, int(inputs[i])
+        else:
+            ops[ip] = _OP_BAD
+    return ops, args
+
+
+# Every handler takes (vm, ip, arg) and returns the next ip: _FAIL (or any
+# other out-of-program address) stops the run, _HALTED ends it successfully.
+_FAIL = -1
+_HALTED = -2
+
+
+class _VMState:
+    """Run state; the stack is preallocated to ``cap`` slots, ``sp`` is its size."""
+
+    __slots__ = ("stack", "sp", "out", "cap")
+
+    def __init__(self, cap: int) -> None:
+        self.stack: List[int] = [0] * cap
+        self.sp = 0
+        self.out: List[str] = []
+        self.cap = cap
+
+
+def _op_push(vm: _VMState, ip: int, arg: int) -> int:
+    sp = vm.sp
+    if sp >= vm.cap:
+        return _FAIL
+    vm.stack[sp] = arg
+    vm.sp = sp + 1
+    return ip + 1
+
+
+def _trunc_div(a: int, b: int) -> int:
+    return int(a / b)
+
+
+# Arithmetic ops indexed by opcode id (None for the other opcodes).
+_BIN: Tuple[Optional[Callable[[int, int], int]], ...] = tuple(
+    {
+        _OP_ADD: operator.add,
+        _OP_SUB: operator.sub,
+        _OP_MUL: operator.mul,
+        _OP_DIV: _trunc_div,
+        _OP_MOD: operator.mod,
+    }.get(opc)
+    for opc in range(_OP_BAD + 1)
+)
 
 
+def _arith(op: int) -> Callable[[_VMState, int, int], int]:
+    fn = _BIN[op]
+    by_zero_fails = op == _OP_DIV or op == _OP_MOD
+
+    def handler(vm: _VMState, ip: int, arg: int) -> int:
+        sp = vm.sp
+        if sp < 2:
+            return _FAIL
+        stack = vm.stack
+        b = stack[sp - 1]
+        if by_zero_fails and b == 0:
+            return _FAIL
+        stack[sp - 2] = fn(stack[sp - 2], b)
+        vm.sp = sp - 1
+        return ip + 1
+    return handler
+
+
+def _op_dup(vm: _VMState, ip: int, arg: int) -> int:
+    sp = vm.sp
+    if sp == 0 or sp >= vm.cap:
+        return _FAIL
+    vm.stack[sp] = vm.stack[sp - 1]
+    vm.sp = sp + 1
+    return ip + 1
+
+
+def _op_swap(vm: _VMState, ip: int, arg: int) -> int:
+    sp = vm.sp
+    if sp < 2:
+        return _FAIL
+    stack = vm.stack
+    stack[sp - 1], stack[sp - 2] = stack[sp - 2], stack[sp - 1]
+    return ip + 1
+
+
+def _op_pop(vm: _VMState, ip: int, arg: int) -> int:
+    if vm.sp == 0:
+        return _FAIL
+    vm.sp -= 1
+    return ip + 1
+
+
+def _op_jmp(vm: _VMState, ip: int, arg: int) -> int:
+    return arg
+
+
+def _op_jmpz(vm: _VMState, ip: int, arg: int) -> int:
+    if vm.sp == 0:
+        return _FAIL
+    vm.sp -= 1
+    return arg if vm.stack[vm.sp] == 0 else ip + 1
+
+
+def _op_jmpnz(vm: _VMState, ip: int, arg: int) -> int:
+    if vm.sp == 0:
+        return _FAIL
+    vm.sp -= 1
+    return arg if vm.stack[vm.sp] != 0 else ip + 1
+
+
+def _op_print(vm: _VMState, ip: int, arg: int) -> int:
+    if vm.sp == 0:
+        return _FAIL
+    vm.sp -= 1
+    vm.out.append(str(vm.stack[vm.sp]))
+    return ip + 1
+
+
+def _op_halt(vm: _VMState, ip: int, arg: int) -> int:
+    return _HALTED
+
+
+def _op_bad(vm: _VMState, ip: int, arg: int) -> int:
+    return _FAIL
+
+
+# Indexed by opcode id; LOAD never runs, _lower turns it into PUSH.
+_HANDLERS: Tuple[Callable[[_VMState, int, int], int], ...] = (
+    _op_push, _op_bad, _arith(_OP_ADD), _arith(_OP_SUB), _arith(_OP_MUL), _arith(_OP_DIV),
+    _arith(_OP_MOD), _op_dup, _op_swap, _op_pop, _op_jmp, _op_jmpz, _op_jmpnz, _op_print,
+    _op_halt, _op_bad,
+)
+
+
+def _execute(ops: List[int], args: List[int], max_steps: int, cap: int) -> Tuple[bool, str]:
+    vm = _VMState(cap)
+    handlers = _HANDLERS
+    n = len(ops)
+    ip = 0
+    for _ in range(max_steps + 1):
+        if ip < 0 or ip >= n:
+            break
+        ip = handlers[ops[ip]](vm, ip, args[ip])
+    if ip != _HALTED:
+        return (False, "")
+    return (True, "\n".join(vm.out))
+
 # --------------------------- Server wrapper ------------------------------- #
 class HvmEnvInstance:
-    def __init__(self) -> None:
+    def __init__(self, challenges: Optional[ChallengePool] = None) -> None:
         self.env = StandaloneHVM()
         self.prompt: Optional[str] = None
+        self._challenges = challenges
 
     async def reset(self) -> str:
-        prompt, _ = await self.env.generate()
+        challenge = self._challenges.take() if self._challenges is not None else None
+        if challenge is None:
+            prompt, _ = await self.env.generate()
+        else:
+            self.env.current = challenge
+            prompt = challenge["prompt"]
         self.prompt = prompt
         return prompt
 
@@ -329,14 +556,17 @@ class HvmEnvInstance:
 
 
 class HvmEnvServer:
-    def __init__(self) -> None:
+    def __init__(self, pool_size: int = 64) -> None:
         self._max_id: int = 0
         self.envs: Dict[int, HvmEnvInstance] = {}
+        self._challenges = ChallengePool(StandaloneHVM, pool_size)
 
     async def create(self) -> int:
+        # The pool starts filling with the first env, on the server's loop.
+        self._challenges.start()
         env_idx = self._max_id
         self._max_id += 1
-        self.envs[env_idx] = HvmEnvInstance()
+        self.envs[env_idx] = HvmEnvInstance(self._challenges)
         return env_idx
 
     async def observation(self, env_idx: int) -> str:
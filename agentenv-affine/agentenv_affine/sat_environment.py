@@ -9,6 +9,16 @@ import random
 import re
 from typing import Any, Dict, List, Optional, Tuple
 
+from .challenge_pool import ChallengePool
+
+_ASSIGN_RE = re.compile(r"x(\d+)=(True|False|1|0)")
+# The values _ASSIGN_RE reads as true.
+_TRUE_VALS = frozenset({"True", "1"})
+_PROMPT_TAIL = (
+    "Provide your answer as comma-separated assignments like `x1=True, x2=False, ...`, "
+    "or respond `UNSAT` if it has no solution."
+)
+
 
 class StandaloneSAT:
     def __init__(self, n: int = 15, k: int = 10, m: Optional[int] = None, seed: Optional[int] = None) -> None:
@@ -17,29 +27,36 @@ class StandaloneSAT:
         self.m = int(m if m is not None else int(4.26 * self.n))
         self._rng = random.Random(seed)
         self.current: Optional[Dict[str, Any]] = None  # {sol, cls, prompt}
+        self._vars = range(1, self.n + 1)
+        # Text of every literal, shared by all the formulas of this instance.
+        self._lit_text = {v: f"x{v}" for v in range(1, self.n + 1)}
+        self._lit_text.update({-v: f"¬x{v}" for v in range(1, self.n + 1)})
+        self._prompt_head = (
+            f"Find a satisfying assignment for the following {self.k}-SAT formula over variables x1..x{self.n}:\n"
+        )
 
     async def generate(self) -> Tuple[str, Dict[str, Any]]:
-        sol = {i: self._rng.choice([True, False]) for i in range(1, self.n + 1)}
-        cls: List[List[int]] = []
+        rng = self._rng
+        # Three draws per clause: its variables, the one forced to agree with
+        # ``sol`` and the signs of all the others (one random bit each).
+        sol_bits = rng.getrandbits(self.n)
+        sol = {v: bool(sol_bits >> (v - 1) & 1) for v in self._vars}
+        cls: List[Tuple[int, ...]] = []
         for _ in range(self.m):
-            vs = self._rng.sample(list(sol), self.k)
-            sv = self._rng.choice(vs)
-            clause: List[int] = []
-            for v in vs:
-                if v == sv:
-                    lit = v if sol[v] else -v
-                else:
-                    lit = v if self._rng.choice([True, False]) else -v
-                clause.append(lit)
-            cls.append(clause)
-        formula = " ∧ ".join("(" + " ∨ ".join(("" if l > 0 else "¬") + f"x{abs(l)}" for l in c) + ")" for c in cls)
-        prompt = (
-            f"Find a satisfying assignment for the following {self.k}-SAT formula over variables x1..x{self.n}:\n"
-            f"{formula}\n"
-            "Provide your answer as comma-separated assignments like `x1=True, x2=False, ...`, "
-            "or respond `UNSAT` if it has no solution."
-        )
-        self.current = {"sol": sol, "cls": cls, "prompt": prompt}
+            vs = rng.sample(self._vars, self.k)
+            pivot = rng.randrange(self.k)
+            signs = rng.getrandbits(self.k)
+            cls.append(tuple(
+                v if (sol[v] if i == pivot else signs >> i & 1) else -v for i, v in enumerate(vs)
+            ))
+        lit_text = self._lit_text
+        clause_strs = ["(" + " ∨ ".join([lit_text[l] for l in c]) + ")" for c in cls]
+        prompt = "".join((self._prompt_head, " ∧ ".join(clause_strs), "\n", _PROMPT_TAIL))
+        # Clauses as (positive, negative) variable bitmasks, bit v standing for x<v>.
+        cls_masks = [
+            (sum(1 << l for l in c if l > 0), sum(1 << -l for l in c if l < 0)) for c in cls
+        ]
+        self.current = {"sol": sol, "cls": cls, "cls_masks": cls_masks, "prompt": prompt}
         return prompt, self.current
 
     async def evaluate(self, agent_text: str) -> Tuple[float, Dict[str, Any]]:
@@ -49,24 +66,37 @@ class StandaloneSAT:
             # Les formules sont satisfaisables par construction
             return 0.0, {"error": "Formula is satisfiable; UNSAT is incorrect"}
         got = {
-            int(v): val.lower() in ("true", "1")
-            for v, val in re.findall(r"x(\d+)=(True|False|1|0)", agent_text or "")
+            int(v): val in _TRUE_VALS
+            for v, val in _ASSIGN_RE.findall(agent_text or "")
         }
         if not got:
             return 0.0, {"error": "No valid assignment parsed"}
         sol = self.current["sol"]
-        cls = self.current["cls"]
-        ok = all(any(((lit > 0) == got.get(abs(lit), None)) for lit in c) for c in cls)
+        # Unassigned variables satisfy no literal, hence separate true/false masks.
+        true_mask = false_mask = 0
+        for v, val in got.items():
+            if v <= self.n:
+                if val:
+                    true_mask |= 1 << v
+                else:
+                    false_mask |= 1 << v
+        ok = all((pos & true_mask) or (neg & false_mask) for pos, neg in self.current["cls_masks"])
         return (1.0 if ok else 0.0), {"expected": sol, "got": got}
 
 
 class SatEnvInstance:
-    def __init__(self) -> None:
+    def __init__(self, challenges: Optional[ChallengePool] = None) -> None:
         self.env = StandaloneSAT()
         self.prompt: Optional[str] = None
+        self._challenges = challenges
 
     async def reset(self) -> str:
-        prompt, _ = await self.env.generate()
+        challenge = self._challenges.take() if self._challenges is not None else None
+        if challenge is None:
+            prompt, _ = await self.env.generate()
+        else:
+            self.env.current = challenge
+            prompt = challenge["prompt"]
         self.prompt = prompt
         return prompt
 
@@ -80,14 +110,17 @@ class SatEnvInstance:
 
 
 class SatEnvServer:
-    def __init__(self) -> None:
+    def __init__(self, pool_size: int = 64) -> None:
         self._max_id: int = 0
         self.envs: Dict[int, SatEnvInstance] = {}
+        self._challenges = ChallengePool(StandaloneSAT, pool_size)
 
     async def create(self) -> int:
+        # The pool starts filling with the first env, on the server's loop.
+        self._challenges.start()
         env_idx = self._max_id
         self._max_id += 1
-        self.envs[env_idx] = SatEnvInstance()
+        self.envs[env_idx] = SatEnvInstance(self._challenges)
         return env_idx
 
     async def observation(self, env_idx: int) -> str:
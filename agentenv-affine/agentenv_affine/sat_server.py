@@ -1,10 +1,12 @@
 from typing import List
 
 from fastapi import FastAPI
+from fastapi.responses import ORJSONResponse
 
 from .sat_environment import sat_env_server
+from .sat_model import ResetQuery, StepQuery
 
-app = FastAPI()
+app = FastAPI(default_response_class=ORJSONResponse)
 
 @app.get("/", response_model=str)
 def ok():
@@ -20,16 +22,14 @@ async def create():
     return {"id": env}
 
 @app.get("/observation", response_model=str)
-async def observation(id: int):
-    return await sat_env_server.observation(id)
+async def observation(env_idx: int):
+    return await sat_env_server.observation(env_idx)
 
 @app.post("/step")
-async def step(payload: dict):
-    id_ = int(payload["id"]) ; action = payload["action"]
-    obs, reward, done, info = await sat_env_server.step(id_, action)
+async def step(body: StepQuery):
+    obs, reward, done, info = await sat_env_server.step(body.env_idx, body.action)
     return {"observation": obs, "reward": reward, "done": done, "info": info}
 
 @app.post("/reset", response_model=str)
-async def reset(payload: dict):
-    id_ = int(payload["id"]) 
-    return await sat_env_server.reset(id_) 
\ No newline at end of file
+async def reset(body: ResetQuery):
+    return await sat_env_server.reset(body.env_idx) 
\ No newline at end of file
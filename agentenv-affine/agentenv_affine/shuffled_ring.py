@@ -0,0 +1,27 @@
+"""
+Sample order shared by the envs that draw challenges from a fixed pool.
+
+Every index is served once per round, in an order reshuffled at the start of
+each round, so an env never repeats a challenge before it has served them all.
+"""
+from __future__ import annotations
+
+import random
+from typing import List, Optional
+
+
+class ShuffledRing:
+    def __init__(self, seed: Optional[int] = None) -> None:
+        self._rng = random.Random(seed)
+        self._order: List[int] = []
+        self._cursor = 0
+
+    def next_index(self, size: int) -> int:
+        """Next index into a pool of ``size`` items (``size`` is read at round starts)."""
+        if self._cursor >= len(self._order):
+            self._order = list(range(size))
+            self._rng.shuffle(self._order)
+            self._cursor = 0
+        idx = self._order[self._cursor]
+        self._cursor += 1
+        return idx
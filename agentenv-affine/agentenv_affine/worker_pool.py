@@ -0,0 +1,292 @@
+"""
+Warm Python worker pool used to execute programs for the affine envs.
+
+Each worker is a zygote (see ``zygote``): a fresh interpreter, started once
+with ``python -m agentenv_affine.zygote`` so that it inherits nothing from the
+server (open sockets, loaded datasets, ...), which receives
+{program, stdin, timeout} messages over a socketpair, the program being source
+text or a code object marshalled once by ``WorkerPool.compile``. The zygote
+forks a hardened child per job, so evaluations no longer pay interpreter
+start-up for every test case while every program still starts from a clean
+process. Results are the raw ``(stdout, stderr)`` bytes. A worker can also
+keep a loaded program for a short session and call its functions directly (see
+``WorkerPool.call_batch``). A worker that overruns its timeout (or dies) is
+killed and replaced.
+"""
+from __future__ import annotations
+
+import asyncio
+import marshal
+import os
+import socket
+import subprocess
+import sys
+import threading
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional, Tuple, Union
+
+from .zygote import HEADER, frame
+
+# Extra time granted to a worker, on top of the job timeout, before the parent
+# considers it stuck and kills it.
+_GRACE_S = 1.0
+# Directory holding the agentenv_affine package, for the zygotes' sys.path.
+_PKG_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Replies for jobs that timed out or died (sent by the zygotes or made up here).
+_FAILED_JOBS = frozenset({(b"", b"TIMEOUT"), (b"", b"Worker exited unexpectedly")})
+
+
+# -------------------------------- Pool ---------------------------------- #
+
+def _retrieve_exception(task: "asyncio.Future[Any]") -> None:
+    # Jobs may end after their caller stopped waiting: mark their errors as seen.
+    if not task.cancelled():
+        task.exception()
+
+
+async def _recv_exact(loop: asyncio.AbstractEventLoop, sock: socket.socket, n: int) -> bytes:
+    buf = bytearray()
+    while len(buf) < n:
+        chunk = await loop.sock_recv(sock, n - len(buf))
+        if not chunk:
+            raise EOFError("worker connection closed")
+        buf += chunk
+    return bytes(buf)
+
+
+async def _recv_reply(loop: asyncio.AbstractEventLoop, sock: socket.socket) -> Any:
+    (n,) = HEADER.unpack(await _recv_exact(loop, sock, HEADER.size))
+    return marshal.loads(await _recv_exact(loop, sock, n))
+
+
+class _Worker:
+    def __init__(self) -> None:
+        self.sock, child_sock = socket.socketpair()
+        env = dict(os.environ)
+        env["PYTHONPATH"] = os.pathsep.join(filter(None, (_PKG_ROOT, env.get("PYTHONPATH"))))
+        try:
+            self.proc = subprocess.Popen(
+                [sys.executable, "-m", "agentenv_affine.zygote", str(child_sock.fileno())],
+                stdin=subprocess.DEVNULL,
+                pass_fds=(child_sock.fileno(),),
+                env=env,
+                # Out of the terminal's process group: Ctrl-C is for the server;
+                # zygotes exit when their socket closes.
+                start_new_session=True,
+            )
+        finally:
+            child_sock.close()
+        self.sock.setblocking(False)
+
+    async def request(self, msg: Dict[str, Any]) -> Tuple[bytes, bytes]:
+        loop = asyncio.get_running_loop()
+        await loop.sock_sendall(self.sock, frame(msg))
+        out, err = await asyncio.wait_for(_recv_reply(loop, self.sock), msg["timeout"] + _GRACE_S)
+        return out, err
+
+    async def notify(self, msg: Dict[str, Any]) -> None:
+        await asyncio.get_running_loop().sock_sendall(self.sock, frame(msg))
+
+    def kill(self) -> None:
+        try:
+            self.sock.close()
+        finally:
+            if self.proc.poll() is None:
+                self.proc.kill()
+            self.proc.wait()
+
+
+class WorkerPool:
+    """
+    Fixed-size pool of warm interpreters driven from the event loop.
+
+    Requests are plain non-blocking socket operations, so any number of
+    evaluations wait on their workers from a single thread; ``submit`` waits
+    for a free worker when all of them are busy.
+    """
+
+    def __init__(self, size: Optional[int] = None) -> None:
+        self.size = int(size or os.cpu_count() or 1)
+        # Zygotes fork their jobs: without fork(), every program gets its own interpreter.
+        self._forking = hasattr(os, "fork")
+        self._idle: Deque[_Worker] = deque()
+        self._waiters: Deque[asyncio.Future] = deque()
+        if self._forking:
+            for _ in range(self.size):
+                self._idle.append(_Worker())
+
+    def compile(self, src: str) -> Union[str, bytes]:
+        """Compile ``src`` once for repeated ``submit`` calls; raises SyntaxError."""
+        return marshal.dumps(compile(src, "<prog>", "exec"))
+
+    async def _acquire(self) -> _Worker:
+        while not self._idle:
+            fut = asyncio.get_running_loop().create_future()
+            self._waiters.append(fut)
+            try:
+                await fut
+            except asyncio.CancelledError:
+                if fut.done() and not fut.cancelled():
+                    # Woken up and cancelled at once: pass the wake-up on.
+                    self._wake()
+                raise
+        return self._idle.popleft()
+
+    def _wake(self) -> None:
+        while self._waiters:
+            fut = self._waiters.popleft()
+            if not fut.done():
+                fut.set_result(None)
+                return
+
+    def _release(self, worker: _Worker) -> None:
+        self._idle.append(worker)
+        self._wake()
+
+    async def _request(self, worker: _Worker, msg: Dict[str, Any]) -> Tuple[_Worker, Tuple[bytes, bytes]]:
+        """Send ``msg``; a worker that times out or dies is replaced by a fresh one."""
+        try:
+            return worker, await worker.request(msg)
+        except asyncio.TimeoutError:
+            result = (b"", b"TIMEOUT")
+        except (EOFError, OSError):
+            result = (b"", b"Worker exited unexpectedly")
+        worker.kill()
+        return _Worker(), result
+
+    def _discard(self, worker: _Worker) -> None:
+        # An interrupted request may leave a reply in flight: never reuse its worker.
+        worker.kill()
+        self._release(_Worker())
+
+    async def _run_job(self, job: Callable[[_Worker], Awaitable[Tuple[_Worker, Any]]]) -> Any:
+        """
+        Run ``job`` on a free worker and return its result. Once started, the
+        job runs to completion even if the caller is cancelled, so that its
+        reply is drained and the worker goes back to the pool instead of being
+        killed (callers commonly give up on jobs whose result is moot).
+        """
+        worker = await self._acquire()
+
+        async def run() -> Any:
+            nonlocal worker
+            try:
+                worker, result = await job(worker)
+            except BaseException:
+                self._discard(worker)
+                raise
+            self._release(worker)
+            return result
+
+        task = asyncio.ensure_future(run())
+        task.add_done_callback(_retrieve_exception)
+        return await asyncio.shield(task)
+
+    async def submit(self, code: Union[str, bytes], stdin: str = "", timeout: float = 5.0) -> Tuple[bytes, bytes]:
+        if not self._forking:
+            return await _execute_subprocess(code, None, stdin, timeout)
+        msg = {"src": code, "stdin": stdin, "timeout": float(timeout)}
+        return await self._run_job(lambda worker: self._request(worker, msg))
+
+    async def call_batch(
+        self, code: Union[str, bytes], calls: List[Tuple[str, Any]], timeout: float = 5.0
+    ) -> List[Tuple[bytes, bytes]]:
+        """
+        Load ``code`` once as ``__main__`` and print ``fn(*args)`` for every
+        ``(fn, args)`` in ``calls``, each call in its own copy of the loaded
+        program. Each result carries the load output followed by the call
+        output, like a script ending with that call.
+        """
+        if not self._forking:
+            return list(await asyncio.gather(*(_execute_subprocess(code, call, "", timeout) for call in calls)))
+        return await self._run_job(lambda worker: self._session(worker, code, calls, float(timeout)))
+
+    async def _session(
+        self, worker: _Worker, code: Union[str, bytes], calls: List[Tuple[str, Any]], timeout: float
+    ) -> Tuple[_Worker, List[Tuple[bytes, bytes]]]:
+        load_msg = {"op": "load", "src": code, "timeout": timeout}
+        worker, (load_out, load_err) = await self._request(worker, load_msg)
+        if load_err.strip():
+            results = [(load_out, load_err)] * len(calls)
+        else:
+            results = []
+            for fn, args in calls:
+                msg = {"op": "call", "fn": fn, "args": args, "timeout": timeout}
+                replaced, (out, err) = await self._request(worker, msg)
+                if replaced is worker:
+                    # Like a killed process, a call that failed prints nothing.
+                    results.append((out, err) if (out, err) in _FAILED_JOBS else (load_out + out, err))
+                else:
+                    # The session died with its worker: reload into the new one.
+                    results.append((out, err))
+                    worker, _ = await self._request(replaced, load_msg)
+        await worker.notify({"op": "end"})
+        return worker, results
+
+    def close(self) -> None:
+        while self._idle:
+            self._idle.popleft().kill()
+
+
+# Reads a length line and a marshalled (program, call) pair from stdin, then
+# runs the program (and the call) with the rest of stdin left to it.
+_SUBPROCESS_LOADER = """\
+import marshal, sys
+buf = sys.stdin.buffer
+src, call = marshal.loads(buf.read(int(buf.readline())))
+code = marshal.loads(src) if isinstance(src, bytes) else compile(src, "<prog>", "exec")
+ns = {"__name__": "__main__", "__builtins__": __builtins__}
+del buf, src, marshal
+exec(code, ns)
+if call is not None:
+    if call[0] not in ns:
+        raise NameError(f"name {call[0]!r} is not defined")
+    print(ns[call[0]](*call[1]))
+"""
+
+
+async def _execute_subprocess(
+    code: Union[str, bytes], call: Optional[Tuple[str, Any]], stdin: str, timeout: float
+) -> Tuple[bytes, bytes]:
+    # Platforms without fork(): fall back to one interpreter per program. The
+    # program travels as a marshalled code object, so it is not parsed again.
+    blob = marshal.dumps((code, call))
+    proc = await asyncio.create_subprocess_exec(
+        sys.executable,
+        "-c",
+        _SUBPROCESS_LOADER,
+        stdin=asyncio.subprocess.PIPE,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+    )
+    try:
+        return await asyncio.wait_for(proc.communicate(b"%d\n" % len(blob) + blob + stdin.encode()), timeout)
+    except asyncio.TimeoutError:
+        return b"", b"TIMEOUT"
+    finally:
+        if proc.returncode is None:
+            proc.kill()
+            await proc.wait()
+
+
+_pool: Optional[WorkerPool] = None
+_pool_lock = threading.Lock()
+
+
+def get_pool() -> WorkerPool:
+    """Return the process-wide pool, starting its workers on first use."""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = WorkerPool()
+    return _pool
+
+
+def close_pool() -> None:
+    """Stop the process-wide pool's workers, if it was ever started."""
+    global _pool
+    with _pool_lock:
+        pool, _pool = _pool, None
+    if pool is not None:
+        pool.close()
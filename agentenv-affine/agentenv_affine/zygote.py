@@ -0,0 +1,421 @@
+"""
+Zygote side of the worker pool.
+
+A zygote is a long-lived interpreter started from scratch by the pool (see
+``worker_pool``), with the modules programs commonly use already imported. For
+every job received on its socketpair it forks a child that hardens itself
+(no_new_privs, CPU rlimit, death with its parent) and runs the program with
+file descriptors 0-2 redirected to in-memory files, every other fd closed.
+Once the child has exited, the zygote reads those files back and sends
+``(stdout, stderr)`` itself. Programs thus start warm, but never see state
+left behind by another one, nor the channel that carries the replies.
+
+Messages are marshalled objects framed by a 4-byte length prefix:
+- ``{"src", "stdin", "timeout"}`` runs a program once;
+- ``{"op": "load", "src", "timeout"}`` starts a session whose child loads the
+  program and answers ``{"op": "call", "fn", "args", "timeout"}`` messages
+  until ``{"op": "end"}``, forking every call from the loaded namespace so
+  that calls do not see each other's state either.
+"""
+from __future__ import annotations
+
+import builtins
+import ctypes
+import importlib
+import marshal
+import math
+import os
+import resource
+import select
+import signal
+import socket
+import struct
+import sys
+import tempfile
+import threading
+import traceback
+from types import CodeType, ModuleType
+from typing import Any, Callable, Dict, Optional, Tuple, Union
+
+HEADER = struct.Struct("!I")
+
+_PR_SET_PDEATHSIG = 1
+_PR_SET_NO_NEW_PRIVS = 38
+
+try:
+    _prctl = getattr(ctypes.CDLL(None, use_errno=True), "prctl", None)
+except OSError:
+    _prctl = None
+
+_real_exit = os._exit
+# Exit status of a child whose program ran out of time.
+_TIMEOUT_STATUS = 124
+# Imported once by every zygote, so that programs do not pay for them.
+_WARM_MODULES = (
+    "bisect", "collections", "functools", "heapq", "itertools", "math", "re", "string", "typing",
+)
+# How long past its timeout a child may take to exit before it is killed.
+_WAIT_SLACK_S = 0.5
+
+
+# ------------------------------- Framing -------------------------------- #
+
+def frame(obj: Any) -> bytes:
+    data = marshal.dumps(obj)
+    return HEADER.pack(len(data)) + data
+
+
+def send_msg(sock: socket.socket, obj: Any) -> None:
+    sock.sendall(frame(obj))
+
+
+def _recv_exact(sock: socket.socket, n: int) -> bytes:
+    buf = bytearray()
+    while len(buf) < n:
+        chunk = sock.recv(n - len(buf))
+        if not chunk:
+            raise EOFError("worker connection closed")
+        buf += chunk
+    return bytes(buf)
+
+
+def recv_msg(sock: socket.socket) -> Any:
+    (n,) = HEADER.unpack(_recv_exact(sock, HEADER.size))
+    return marshal.loads(_recv_exact(sock, n))
+
+
+# ----------------------------- Program runs ------------------------------ #
+
+class _Timeout(BaseException):
+    pass
+
+
+def _on_alarm(signum, frame):
+    raise _Timeout()
+
+
+def _exit_shim(status: int = 0) -> None:
+    # ``os._exit`` would skip flushing the output and report a crash; turn
+    # it into a regular exit of the program instead.
+    raise SystemExit(status)
+
+
+def _user_traceback(e: BaseException) -> str:
+    # Drop this module's frames so the traceback looks like the one `python3 -c` prints.
+    tb = e.__traceback__
+    while tb is not None and tb.tb_frame.f_code.co_filename == __file__:
+        tb = tb.tb_next
+    return "".join(traceback.format_exception(type(e), e, tb))
+
+
+def _mem_file(name: str) -> int:
+    if hasattr(os, "memfd_create"):
+        return os.memfd_create(name)
+    fd, path = tempfile.mkstemp(prefix=name)
+    os.unlink(path)
+    return fd
+
+
+def _write_all(fd: int, data: bytes) -> None:
+    view = memoryview(data)
+    while view:
+        view = view[os.write(fd, view):]
+
+
+def _read_all(fd: int) -> bytes:
+    os.lseek(fd, 0, os.SEEK_SET)
+    chunks = []
+    while True:
+        chunk = os.read(fd, 1 << 16)
+        if not chunk:
+            return b"".join(chunks)
+        chunks.append(chunk)
+
+
+def _redirect_std(fds: Tuple[int, int, int], keep: Tuple[int, ...] = ()) -> None:
+    """
+    Make ``fds`` the process's fds 0-2 (and rebuild the sys streams over
+    them, as a fresh interpreter would have them), then close every other fd
+    but ``keep``: the program must not reach the zygote's sockets.
+    """
+    for fd, target in zip(fds, (0, 1, 2)):
+        os.dup2(fd, target)
+    max_fd = os.sysconf("SC_OPEN_MAX") if hasattr(os, "sysconf") else 1 << 16
+    lo = 3
+    for fd in sorted(keep) + [max_fd]:
+        os.closerange(lo, fd)
+        lo = fd + 1
+    sys.stdin = sys.__stdin__ = open(0, "r", encoding="utf-8", closefd=False)
+    sys.stdout = sys.__stdout__ = open(1, "w", encoding="utf-8", errors="replace", closefd=False)
+    sys.stderr = sys.__stderr__ = open(2, "w", encoding="utf-8", errors="backslashreplace", closefd=False)
+
+
+def _guarded(fn: Callable[[], Any], timeout: float, join_threads: bool = True) -> bool:
+    """
+    Run ``fn`` under a ``timeout`` second alarm, reporting its errors on
+    stderr like ``python3 -c``; return whether it timed out. Unless
+    ``join_threads`` is false, the program's non-daemon threads are then
+    waited for, as at interpreter exit.
+    """
+    err = sys.stderr
+    os._exit = _exit_shim
+    signal.signal(signal.SIGALRM, _on_alarm)
+    signal.setitimer(signal.ITIMER_REAL, timeout)
+    try:
+        try:
+            fn()
+        except SystemExit as e:
+            if e.code is not None and not isinstance(e.code, int):
+                err.write(f"{e.code}\n")
+        except _Timeout:
+            raise
+        except BaseException as e:
+            err.write(_user_traceback(e))
+        if join_threads:
+            threading._shutdown()
+    except _Timeout:
+        return True
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        os._exit = _real_exit
+        for stream in {err, sys.stdout, sys.stderr, sys.__stdout__, sys.__stderr__}:
+            try:
+                stream.flush()
+            except Exception:
+                pass
+    return False
+
+
+def _load_code(src: Union[str, bytes]) -> CodeType:
+    return marshal.loads(src) if isinstance(src, bytes) else compile(src, "<prog>", "exec")
+
+
+def _main_namespace() -> Dict[str, Any]:
+    """Install and return a fresh ``__main__`` module for the program, as ``python3 -c`` has."""
+    main = ModuleType("__main__")
+    main.__builtins__ = builtins
+    sys.modules["__main__"] = main
+    return main.__dict__
+
+
+def _call_and_print(ns: Dict[str, Any], fn: str, args: Any) -> None:
+    if fn not in ns:
+        raise NameError(f"name {fn!r} is not defined")
+    print(ns[fn](*args))
+
+
+def _std_files(stdin: str) -> Tuple[int, int, int]:
+    fds = (_mem_file("stdin"), _mem_file("stdout"), _mem_file("stderr"))
+    _write_all(fds[0], stdin.encode())
+    os.lseek(fds[0], 0, os.SEEK_SET)
+    return fds
+
+
+def _close_all(fds: Tuple[int, ...]) -> None:
+    for fd in fds:
+        os.close(fd)
+
+
+# ------------------------------- Children -------------------------------- #
+
+def _harden(cpu_seconds: Optional[float]) -> None:
+    if _prctl is not None:
+        _prctl(_PR_SET_PDEATHSIG, int(signal.SIGKILL), 0, 0, 0)
+        _prctl(_PR_SET_NO_NEW_PRIVS, 1, 0, 0, 0)
+    if cpu_seconds is not None:
+        # Backstop for programs that defeat the alarm (e.g. by ignoring SIGALRM).
+        limit = int(math.ceil(cpu_seconds)) + 1
+        resource.setrlimit(resource.RLIMIT_CPU, (limit, limit + 1))
+
+
+def _fork_group() -> int:
+    """fork() a child leading its own process group, so it can be killed with its forks."""
+    pid = os.fork()
+    try:
+        # Set from both sides: whichever runs first wins the race with killpg().
+        os.setpgid(0 if pid == 0 else pid, 0 if pid == 0 else pid)
+    except OSError:
+        pass
+    return pid
+
+
+def _kill_group(pid: int) -> None:
+    try:
+        os.killpg(pid, signal.SIGKILL)
+    except OSError:
+        pass
+
+
+def _wait_child(pid: int, timeout: float) -> Optional[bytes]:
+    """
+    Reap ``pid``, killing its process group if it runs past ``timeout``
+    seconds; return an error message if it did not finish normally.
+    """
+    try:
+        pidfd = os.pidfd_open(pid)
+    except (AttributeError, OSError):
+        pidfd = None  # no pidfds (Linux < 5.3): rely on the alarm and CPU limit
+    if pidfd is not None:
+        try:
+            if not select.select([pidfd], [], [], timeout)[0]:
+                _kill_group(pid)
+        finally:
+            os.close(pidfd)
+    _, status = os.waitpid(pid, 0)
+    _kill_group(pid)  # processes the program forked and left behind
+    if os.WIFEXITED(status) and os.WEXITSTATUS(status) == 0:
+        return None
+    if os.WIFEXITED(status) and os.WEXITSTATUS(status) == _TIMEOUT_STATUS:
+        return b"TIMEOUT"
+    if os.WIFSIGNALED(status) and os.WTERMSIG(status) in (signal.SIGXCPU, signal.SIGKILL):
+        return b"TIMEOUT"
+    return b"Worker exited unexpectedly"
+
+
+def _run_job(fn: Callable[[], Any], stdin: str, timeout: float) -> Tuple[bytes, bytes]:
+    """
+    Run ``fn`` in a hardened child and return its ``(stdout, stderr)``. The
+    child only writes to in-memory files; they are read back here, once it
+    has exited, so nothing the program does can reach the reply channel.
+    """
+    fds = _std_files(stdin)
+    pid = _fork_group()
+    if pid == 0:
+        status = 1
+        try:
+            _redirect_std(fds)
+            _harden(timeout)
+            status = _TIMEOUT_STATUS if _guarded(fn, timeout) else 0
+        finally:
+            _real_exit(status)
+    try:
+        error = _wait_child(pid, timeout + _WAIT_SLACK_S)
+        return (b"", error) if error is not None else (_read_all(fds[1]), _read_all(fds[2]))
+    finally:
+        _close_all(fds)
+
+
+def _is_reply(obj: Any) -> bool:
+    return isinstance(obj, tuple) and len(obj) == 2 and all(isinstance(x, bytes) for x in obj)
+
+
+class _Session:
+    """
+    A program loaded once in a session child, which forks a child per call.
+
+    The session child ran the program, so whatever it sends is untrusted: it
+    talks to the zygote over a socketpair of its own, and only well-formed
+    replies to its own calls are ever relayed.
+    """
+
+    def __init__(self, load_msg: Dict[str, Any]) -> None:
+        self.load_msg = load_msg
+        self.pid = 0
+        self.sock: Optional[socket.socket] = None
+        self.loaded = self._start()
+
+    def _start(self) -> Tuple[bytes, bytes]:
+        msg = self.load_msg
+        sock, child_sock = socket.socketpair()
+        fds = _std_files("")
+        pid = _fork_group()
+        if pid == 0:
+            sock.close()
+            _session_child(child_sock, fds, msg)
+        child_sock.close()
+        self.pid, self.sock = pid, sock
+        try:
+            sock.settimeout(msg["timeout"] + _WAIT_SLACK_S)
+            status = recv_msg(sock)
+            if status == "ok":
+                return _read_all(fds[1]), _read_all(fds[2])
+            self.close()
+            return b"", b"TIMEOUT" if status == "timeout" else b"Worker exited unexpectedly"
+        except (OSError, EOFError, ValueError, TypeError):
+            self.close()
+            return b"", b"Worker exited unexpectedly"
+        finally:
+            _close_all(fds)
+
+    def call(self, msg: Dict[str, Any]) -> Tuple[bytes, bytes]:
+        if self.sock is None:
+            # The session child died during an earlier call: reload it.
+            loaded = self._start()
+            if self.sock is None:
+                return loaded
+        try:
+            self.sock.settimeout(msg["timeout"] + 2 * _WAIT_SLACK_S)
+            send_msg(self.sock, msg)
+            reply = recv_msg(self.sock)
+            if _is_reply(reply):
+                return reply
+            error = b"Worker exited unexpectedly"
+        except socket.timeout:
+            error = b"TIMEOUT"
+        except (OSError, EOFError, ValueError, TypeError):
+            error = b"Worker exited unexpectedly"
+        self.close()
+        return b"", error
+
+    def close(self) -> None:
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+            _kill_group(self.pid)
+            os.waitpid(self.pid, 0)
+
+
+def _session_child(sock: socket.socket, fds: Tuple[int, int, int], msg: Dict[str, Any]) -> None:
+    status = 1
+    pid = os.getpid()
+    try:
+        _redirect_std(fds, keep=(sock.fileno(),))
+        # Calls may add up to more CPU than one timeout: rely on the alarm.
+        # Each call runs in its own child, which has its own CPU limit.
+        _harden(None)
+        ns = _main_namespace()
+        # The session outlives the load: never join its threads.
+        timed_out = _guarded(lambda: exec(_load_code(msg["src"]), ns), msg["timeout"], join_threads=False)
+        if os.getpid() != pid:
+            return  # a process the program forked: it must not answer
+        send_msg(sock, "timeout" if timed_out else "ok")
+        while not timed_out:
+            call = recv_msg(sock)
+            fn, args = call["fn"], call["args"]
+            send_msg(sock, _run_job(lambda: _call_and_print(ns, fn, args), "", call["timeout"]))
+        status = 0
+    except (EOFError, OSError):
+        status = 0
+    finally:
+        _real_exit(status)
+
+
+def zygote_main(sock: socket.socket) -> None:
+    for name in _WARM_MODULES:
+        importlib.import_module(name)
+    session: Optional[_Session] = None
+    while True:
+        try:
+            msg = recv_msg(sock)
+        except EOFError:
+            return
+        op = msg.get("op", "run")
+        if op in ("load", "end") and session is not None:
+            session.close()
+            session = None
+        if op == "end":
+            continue
+        if op == "load":
+            session = _Session(msg)
+            reply = session.loaded
+        elif op == "call":
+            reply = session.call(msg) if session is not None else (b"", b"No program loaded")
+        else:
+            src = msg["src"]
+            reply = _run_job(lambda: exec(_load_code(src), _main_namespace()), msg["stdin"], msg["timeout"])
+        send_msg(sock, reply)
+
+
+if __name__ == "__main__":
+    # Started by worker_pool._Worker with the fd of its end of the socketpair.
+    zygote_main(socket.socket(fileno=int(sys.argv[1])))